@@ -1,186 +1,280 @@
 from __future__ import annotations
 
-import html
+import hashlib
+import os
 import re
+import stat
 import subprocess
+import time
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
 
-from flask import Flask, abort, request, send_from_directory
+from flask import Flask, abort, make_response, render_template, request, send_from_directory, stream_template
+from markupsafe import escape
 
 app = Flask(__name__)
+app.jinja_env.trim_blocks = True
+app.jinja_env.lstrip_blocks = True
 
-PANELS_DIR = Path(__file__).resolve().parent / "panels"
+REPO_DIR = Path(__file__).resolve().parent
+PANELS_DIR = REPO_DIR / "panels"
+GIT_DIR = REPO_DIR / ".git"
+PANELS_DIR_REAL = os.path.realpath(PANELS_DIR)
 SLUG_PATTERN = re.compile(r"^[a-zA-Z0-9_-]+$")
 COMMIT_PATTERN = re.compile(r"^[0-9a-fA-F]{7,40}$")
+DIFF_CHUNK_SIZE = 1 << 16
+PANEL_LISTING_TTL = 1.0
+# Line boundaries str.splitlines() honours besides \n; read_text() already folds \r and \r\n.
+LINE_BREAKS = str.maketrans(dict.fromkeys("\v\f\x1c\x1d\x1e\x85\u2028\u2029", "\n"))
+# Leading run of blank lines and "# key: value" comments; it ends at the first other line.
+# Lines may start with a BOM when panel files have been concatenated.
+METADATA_BLOCK = re.compile(r"(?:\ufeff*[^\S\n]*(?:#[^\n]*:[^\n]*)?(?:\n|\Z))*")
+METADATA_LINE = re.compile(r"^\ufeff*[^\S\n]*#+([^:\n]*):([^\n]*)", re.MULTILINE)
+
+# Parsed panels keyed by path; entries are reused while their (mtime_ns, size) stat matches.
+_PANEL_CACHE: Dict[Path, Dict[str, object]] = {}
+# Lowercased gene -> slugs of the panels listing it, tagged with the panel stats it was built from.
+_GENE_INDEX: Tuple[Tuple[Tuple[str, object], ...], Dict[str, List[str]]] = ((), {})
+# Rendered panel listing (the query-less index page) and its ETag, tagged likewise.
+_INDEX_PAGE: Tuple[Tuple[Tuple[str, object], ...], str, str] = ((), "", "")
+# Rendered changelog page per slug, tagged with the HEAD commit it was produced at.
+_CHANGELOG_CACHE: Dict[str, Tuple[str, str]] = {}
+
+
+def head_commit() -> Optional[str]:
+    """Return the commit HEAD points at by reading .git directly, without spawning git."""
+    try:
+        head = (GIT_DIR / "HEAD").read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+    if not head.startswith("ref: "):
+        return head
+
+    ref = head[len("ref: "):]
+    try:
+        return (GIT_DIR / ref).read_text(encoding="utf-8").strip()
+    except OSError:
+        pass
+
+    try:
+        packed_refs = (GIT_DIR / "packed-refs").read_text(encoding="utf-8")
+    except OSError:
+        return None
+    for line in packed_refs.splitlines():
+        sha, _, name = line.partition(" ")
+        if name == ref:
+            return sha
+    return None
+
+
+def git_log(path: Path) -> Optional[str]:
+    cmd = [
+        "git",
+        "log",
+        "--follow",
+        "--date=iso",
+        "--pretty=%h %ad %an %s",
+        "--",
+        str(path),
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return result.stdout
+
+
+def git_show(commit: str, path: Path) -> Optional[Iterator[str]]:
+    """Stream `git show` output in chunks; None if git produced nothing (e.g. unknown commit)."""
+    cmd = ["git", "show", commit, "--", str(path)]
+    proc = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, encoding="utf-8", errors="replace"
+    )
+    first = proc.stdout.read(DIFF_CHUNK_SIZE)
+    if not first.strip():
+        proc.stdout.close()
+        proc.wait()
+        return None
 
+    def chunks() -> Iterator[str]:
+        try:
+            chunk = first
+            while chunk:
+                yield chunk
+                chunk = proc.stdout.read(DIFF_CHUNK_SIZE)
+        finally:
+            proc.stdout.close()
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
 
-def render_page(title: str, body: str) -> str:
-    style = """
-    <style>
-      body { font-family: Arial, sans-serif; max-width: 900px; margin: 0 auto; padding: 1.5rem; }
-      h1, h2, h3 { margin-bottom: 0.4rem; }
-      ul { padding-left: 1.2rem; }
-      .panel-card { border: 1px solid #ddd; padding: 0.75rem; margin-bottom: 0.75rem; border-radius: 4px; }
-      .meta { color: #444; font-size: 0.95rem; }
-      pre { background: #f7f7f7; padding: 0.75rem; border-radius: 4px; overflow: auto; }
-      form { margin-bottom: 1rem; }
-      input[type=text] { padding: 0.4rem; width: 250px; }
-      button { padding: 0.4rem 0.7rem; }
-      .links a { margin-right: 0.8rem; }
-    </style>
-    """
-    return f"<!doctype html><html><head><meta charset='utf-8'><title>{html.escape(title)}</title>{style}</head><body><h1>{html.escape(title)}</h1>{body}</body></html>"
+    return chunks()
+
+
+def resolves_inside_panels_dir(path: Union[Path, str]) -> bool:
+    return os.path.realpath(path).startswith(PANELS_DIR_REAL + os.sep)
 
 
 def safe_panel_path(slug: str) -> Path:
-    if not SLUG_PATTERN.match(slug):
+    if not SLUG_PATTERN.fullmatch(slug):
         abort(404)
-    panel_path = (PANELS_DIR / f"{slug}.txt").resolve()
-    if not str(panel_path).startswith(str(PANELS_DIR.resolve())):
-        abort(400)
-    if not panel_path.exists():
+    # SLUG_PATTERN admits no path separators or dots, so only a symlink could point outside
+    # PANELS_DIR. One lstat covers regular files; only symlinks pay for resolving the path.
+    panel_path = PANELS_DIR / f"{slug}.txt"
+    try:
+        mode = os.lstat(panel_path).st_mode
+    except OSError:
+        abort(404)
+    if stat.S_ISLNK(mode):
+        if not resolves_inside_panels_dir(panel_path):
+            abort(400)
+        if not panel_path.is_file():
+            abort(404)
+    elif not stat.S_ISREG(mode):
         abort(404)
     return panel_path
 
 
 def parse_panel(path: Path) -> Tuple[Dict[str, str], List[str]]:
-    metadata: Dict[str, str] = {}
-    genes: List[str] = []
-    metadata_section = True
+    # Normalize line boundaries so the \n-based header regexes split lines like splitlines() does.
+    text = path.read_text(encoding="utf-8-sig").translate(LINE_BREAKS)
+    header_end = METADATA_BLOCK.match(text).end()
+    metadata = {key.strip(): value.strip() for key, value in METADATA_LINE.findall(text, 0, header_end)}
+    lines = text[header_end:].splitlines()
+    if "\ufeff" in text:
+        # Concatenated panel files can carry a BOM at the start of any line, not just the first.
+        lines = [line.lstrip("\ufeff") for line in lines]
+    genes = [gene for gene in map(str.strip, lines) if gene and gene[0] != "#"]
+    return metadata, genes
 
-    for raw_line in path.read_text(encoding="utf-8").splitlines():
-        line = raw_line.lstrip("\ufeff")
-        stripped = line.strip()
 
-        if not stripped:
-            continue
+def load_panel(path: Path) -> Dict[str, object]:
+    file_stat = path.stat()
+    version = (file_stat.st_mtime_ns, file_stat.st_size)
+    panel = _PANEL_CACHE.get(path)
+    if panel is not None and panel["stat"] == version:
+        return panel
 
-        if metadata_section and stripped.startswith("#"):
-            content = stripped.lstrip("#").strip()
-            if ":" in content:
-                key, value = content.split(":", 1)
-                metadata[key.strip()] = value.strip()
-                continue
-            metadata_section = False
-            # fall through to comment handling
+    metadata, genes = parse_panel(path)
+    slug = path.stem
+    title = metadata.get("title", slug.replace("_", " ").title())
+    panel = {
+        "slug": slug,
+        "title": title,
+        "metadata": metadata,
+        "genes": genes,
+        "stat": version,
+        # Escaped once per file change so templates do not re-escape them on every render.
+        "slug_html": escape(slug),
+        "title_html": escape(title),
+        "slug_lower": slug.lower(),
+        "title_lower": title.lower(),
+        "genes_lower": frozenset(gene.lower() for gene in genes),
+    }
+    _PANEL_CACHE[path] = panel
+    return panel
+
+
+def _is_panel_entry(entry: os.DirEntry) -> bool:
+    if not entry.name.endswith(".txt"):
+        return False
+    if entry.is_symlink():
+        return resolves_inside_panels_dir(entry.path) and entry.is_file()
+    return entry.is_file(follow_symlinks=False)
+
+
+@lru_cache(maxsize=1)
+def _list_panel_files(dir_mtime_ns: int, ttl_tick: int) -> Tuple[Path, ...]:
+    with os.scandir(PANELS_DIR) as entries:
+        names = [entry.name for entry in entries if _is_panel_entry(entry)]
+    return tuple(PANELS_DIR / name for name in sorted(names))
+
+
+def list_panel_files() -> Tuple[Path, ...]:
+    # The directory mtime changes when a panel file is added, removed or renamed, but only at
+    # the filesystem's timestamp granularity (1 s on HFS+/FAT, longer under NFS attribute
+    # caching). Two changes inside one tick would leave the mtime as it was, so the listing is
+    # also rescanned once per PANEL_LISTING_TTL.
+    ttl_tick = int(time.monotonic() // PANEL_LISTING_TTL)
+    return _list_panel_files(PANELS_DIR.stat().st_mtime_ns, ttl_tick)
 
-        if stripped.startswith("#"):
-            continue
 
-        metadata_section = False
-        genes.append(stripped)
+def collect_panels() -> List[Dict[str, object]]:
+    paths = list_panel_files()
+    for stale in _PANEL_CACHE.keys() - set(paths):
+        # Concurrent requests may evict the same stale entry.
+        _PANEL_CACHE.pop(stale, None)
+    return [load_panel(path) for path in paths]
 
-    return metadata, genes
 
+def panels_signature(panels: List[Dict[str, object]]) -> Tuple[Tuple[str, object], ...]:
+    return tuple((panel["slug"], panel["stat"]) for panel in panels)
 
-def collect_panels() -> List[Dict[str, object]]:
-    panels: List[Dict[str, object]] = []
-    for path in sorted(PANELS_DIR.glob("*.txt")):
-        metadata, genes = parse_panel(path)
-        slug = path.stem
-        panels.append(
-            {
-                "slug": slug,
-                "title": metadata.get("title", slug.replace("_", " ").title()),
-                "metadata": metadata,
-                "genes": genes,
-            }
-        )
-    return panels
+
+def gene_index(panels: List[Dict[str, object]]) -> Dict[str, List[str]]:
+    global _GENE_INDEX
+    signature = panels_signature(panels)
+    if _GENE_INDEX[0] != signature:
+        index: Dict[str, List[str]] = {}
+        for panel in panels:
+            for gene in panel["genes_lower"]:
+                index.setdefault(gene, []).append(panel["slug"])
+        _GENE_INDEX = (signature, index)
+    return _GENE_INDEX[1]
+
+
+def render_index(
+    panels: List[Dict[str, object]],
+    query: str = "",
+    gene_matches: Sequence[Dict[str, object]] = (),
+    name_matches: Sequence[Dict[str, object]] = (),
+) -> str:
+    return render_template(
+        "index.html",
+        title="PanelApp-lite",
+        query=query,
+        panels=panels,
+        gene_matches=gene_matches,
+        name_matches=name_matches,
+    )
 
 
 @app.route("/")
-def index() -> str:
+def index():
+    global _INDEX_PAGE
     query = request.args.get("q", "").strip()
     panels = collect_panels()
 
-    q_lower = query.lower()
-    gene_matches = []
-    name_matches = []
+    if not query:
+        # The listing only changes with the panel files, so reuse it until one does.
+        signature = panels_signature(panels)
+        if _INDEX_PAGE[0] != signature or not _INDEX_PAGE[1]:
+            page = render_index(panels)
+            _INDEX_PAGE = (signature, page, hashlib.sha1(page.encode("utf-8")).hexdigest())
+        response = make_response(_INDEX_PAGE[1])
+        response.set_etag(_INDEX_PAGE[2])
+        response.headers["Cache-Control"] = "public, max-age=30"
+        return response.make_conditional(request)
 
-    if query:
-        for panel in panels:
-            if q_lower in panel["slug"].lower() or q_lower in str(panel["title"]).lower():
-                name_matches.append(panel)
-            if any(gene.lower() == q_lower for gene in panel["genes"]):
-                gene_matches.append(panel)
-
-    body_parts = [
-        "<form method='get'>",
-        "<input type='text' name='q' placeholder='Search by panel or gene' value='" + html.escape(query) + "'>",
-        "<button type='submit'>Search</button>",
-        "</form>",
-    ]
-
-    if query:
-        body_parts.append(f"<h2>Search results for '{html.escape(query)}'</h2>")
-        if gene_matches:
-            body_parts.append("<h3>Panels containing the gene</h3><ul>")
-            for panel in gene_matches:
-                body_parts.append(
-                    f"<li><a href='/panels/{html.escape(panel['slug'])}'>"
-                    f"{html.escape(panel['title'])}</a> (slug: {html.escape(panel['slug'])})" + "</li>"
-                )
-            body_parts.append("</ul>")
-        else:
-            body_parts.append("<p>No gene matches.</p>")
-
-        if name_matches:
-            body_parts.append("<h3>Panel name matches</h3><ul>")
-            for panel in name_matches:
-                body_parts.append(
-                    f"<li><a href='/panels/{html.escape(panel['slug'])}'>"
-                    f"{html.escape(panel['title'])}</a> (slug: {html.escape(panel['slug'])})" + "</li>"
-                )
-            body_parts.append("</ul>")
-        else:
-            body_parts.append("<p>No panel name matches.</p>")
-
-    body_parts.append("<h2>All panels</h2>")
-    for panel in panels:
-        meta_title = html.escape(panel["title"])
-        slug = html.escape(panel["slug"])
-        body_parts.append(
-            "<div class='panel-card'>"
-            f"<h3><a href='/panels/{slug}'>{meta_title}</a></h3>"
-            f"<div class='meta'>Slug: {slug}</div>"
-            f"<div class='meta'>Genes: {len(panel['genes'])}</div>"
-            "</div>"
-        )
-
-    return render_page("PanelApp-lite", "".join(body_parts))
+    q_lower = query.lower()
+    panels_by_slug = {panel["slug"]: panel for panel in panels}
+    gene_matches = [panels_by_slug[slug] for slug in gene_index(panels).get(q_lower, ())]
+    name_matches = [panel for panel in panels if q_lower in panel["slug_lower"] or q_lower in panel["title_lower"]]
+    return render_index(panels, query, gene_matches, name_matches)
 
 
 @app.route("/panels/<slug>")
 def panel_detail(slug: str) -> str:
-    path = safe_panel_path(slug)
-    metadata, genes = parse_panel(path)
-
-    meta_list = "<ul>" + "".join(
-        f"<li><strong>{html.escape(k)}:</strong> {html.escape(v)}</li>" for k, v in metadata.items()
-    ) + "</ul>" if metadata else "<p>No metadata.</p>"
-
-    gene_list_items = "".join(f"<li>{html.escape(g)}</li>" for g in genes)
-    gene_section = "<ul>" + gene_list_items + "</ul>" if genes else "<p>No genes listed.</p>"
-
-    links = (
-        f"<div class='links'>"
-        f"<a href='/panels/{html.escape(slug)}/raw'>Download raw</a>"
-        f"<a href='/panels/{html.escape(slug)}/changelog'>Changelog</a>"
-        "</div>"
-    )
-
-    body = (
-        f"<div class='panel-card'><h2>{html.escape(metadata.get('title', slug.replace('_', ' ').title()))}</h2>"
-        f"<div class='meta'>Slug: {html.escape(slug)}</div>"
-        f"<h3>Metadata</h3>{meta_list}"
-        f"<h3>Genes ({len(genes)})</h3>{gene_section}"
-        f"{links}</div>"
+    panel = load_panel(safe_panel_path(slug))
+    return render_template(
+        "panel.html",
+        title=f"Panel: {slug}",
+        slug=slug,
+        panel_title=panel["title_html"],
+        metadata=panel["metadata"],
+        genes=panel["genes"],
     )
 
-    return render_page(f"Panel: {slug}", body)
-
 
 @app.route("/panels/<slug>/raw")
 def panel_raw(slug: str):
@@ -191,49 +285,37 @@ def panel_raw(slug: str):
 @app.route("/panels/<slug>/changelog")
 def panel_changelog(slug: str) -> str:
     path = safe_panel_path(slug)
-    cmd = [
-        "git",
-        "log",
-        "--follow",
-        "--date=iso",
-        "--pretty=%h %ad %an %s",
-        "--",
-        str(path),
-    ]
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    if result.returncode != 0 or not result.stdout.strip():
-        content = "<p>No git history found for this panel.</p>"
-    else:
-        lines = []
-        for line in result.stdout.strip().splitlines():
-            if not line:
-                continue
-            parts = line.split(" ", 1)
-            commit = parts[0]
-            rest = parts[1] if len(parts) > 1 else ""
-            link = f"<a href='/panels/{html.escape(slug)}/diff/{html.escape(commit)}'>{html.escape(commit)}</a>"
-            lines.append(f"{link} {html.escape(rest)}")
-        content = "<pre>" + "\n".join(lines) + "</pre>"
-
-    body = f"<div class='panel-card'><h2>Changelog for {html.escape(slug)}</h2>{content}</div>"
-    return render_page(f"Changelog: {slug}", body)
+    # History only changes when HEAD moves, so a page rendered at the current HEAD can be reused.
+    head = head_commit()
+    cached = _CHANGELOG_CACHE.get(slug)
+    if head is not None and cached is not None and cached[0] == head:
+        return cached[1]
+
+    log = git_log(path)
+    entries = []
+    for line in (log or "").strip().splitlines():
+        if not line:
+            continue
+        commit, _, rest = line.partition(" ")
+        entries.append((commit, rest))
+
+    page = render_template("changelog.html", title=f"Changelog: {slug}", slug=slug, entries=entries)
+    if head is not None and log is not None:
+        _CHANGELOG_CACHE[slug] = (head, page)
+    return page
 
 
 @app.route("/panels/<slug>/diff/<commit>")
-def panel_diff(slug: str, commit: str) -> str:
+def panel_diff(slug: str, commit: str):
     path = safe_panel_path(slug)
-    if not COMMIT_PATTERN.match(commit):
+    if not COMMIT_PATTERN.fullmatch(commit):
         abort(400, "Invalid commit format")
 
-    cmd = ["git", "show", commit, "--", str(path)]
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    if result.returncode != 0 or not result.stdout.strip():
-        content = "<p>Unable to display diff for this commit/panel combination.</p>"
-    else:
-        content = "<pre>" + html.escape(result.stdout) + "</pre>"
-
-    body = f"<div class='panel-card'><h2>Diff for {html.escape(slug)} @ {html.escape(commit)}</h2>{content}</div>"
-    return render_page(f"Diff: {slug} @ {commit}", body)
+    title = f"Diff: {slug} @ {commit}"
+    diff = git_show(commit, path)
+    if diff is None:
+        return render_template("diff.html", title=title, slug=slug, commit=commit, diff=None)
+    return stream_template("diff.html", title=title, slug=slug, commit=commit, diff=diff)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,128 @@
+"""parse_panel must agree with the original line-by-line parser and with the validator."""
+
+from __future__ import annotations
+
+import random
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import pytest
+
+from app import parse_panel
+from validate_panels import load_panel
+
+
+def reference_parse_panel(path: Path) -> Tuple[Dict[str, str], List[str]]:
+    """The original per-line state machine that parse_panel replaced."""
+    metadata: Dict[str, str] = {}
+    genes: List[str] = []
+    metadata_section = True
+
+    for raw_line in path.read_text(encoding="utf-8").splitlines():
+        line = raw_line.lstrip("\ufeff")
+        stripped = line.strip()
+
+        if not stripped:
+            continue
+
+        if metadata_section and stripped.startswith("#"):
+            content = stripped.lstrip("#").strip()
+            if ":" in content:
+                key, value = content.split(":", 1)
+                metadata[key.strip()] = value.strip()
+                continue
+            metadata_section = False
+
+        if stripped.startswith("#"):
+            continue
+
+        metadata_section = False
+        genes.append(stripped)
+
+    return metadata, genes
+
+
+CASES = [
+    "",
+    "\n",
+    "ABC\n",
+    "# title: X\n# d: y\nA\nB\n",
+    "\ufeff# title: X\nA\n",
+    "# title: T\nAAA\n\ufeffBBB\n",
+    "# title: T\n\ufeff# source: cat\nAAA\n",
+    "\n\n# title: X\n\n# a: b\nA\n# c: d\nB\n",
+    "# just a comment\n# title: late\nA\n",
+    "  A  \n\tB\t\n# x\n  # y: z\nC D\n",
+    "A\r\nB\r\n",
+    "# t: v\r\nA\r\n",
+    "#title:x\n##k::v\n#   \nA",
+    "# a: b\n#\nA",
+    "# title: X\u2028A\n",
+]
+
+LINE_CHOICES = [
+    "A",
+    "B c",
+    "x\t",
+    " y",
+    "\ufeffBBB",
+    "\ufeff# k: v",
+    "\ufeff",
+    "# k: v",
+    " # a : b : c ",
+    "## #k: v",
+    "#a:b",
+    "#:",
+    "# t: v\r",
+    "#",
+    "# note",
+    "",
+    "  ",
+    "\t",
+    "\r",
+    # Line boundaries for str.splitlines() besides \n and \r.
+    "# title: X\u2028A",
+    "# k: v\x0bB",
+    "C\x0cD",
+    "# a: b\x1c# c: d",
+    "\x1d",
+    "E\x1eF",
+    "# n: m\x85G",
+    "H\u2029# x: y",
+]
+
+
+def random_cases(count: int) -> List[str]:
+    rng = random.Random(1)
+    return [
+        "\n".join(rng.choice(LINE_CHOICES) for _ in range(rng.randint(0, 8))) + rng.choice(["", "\n"])
+        for _ in range(count)
+    ]
+
+
+@pytest.mark.parametrize("text", CASES)
+def test_matches_reference_parser(tmp_path: Path, text: str) -> None:
+    path = tmp_path / "panel.txt"
+    path.write_bytes(text.encode("utf-8"))
+    assert parse_panel(path) == reference_parse_panel(path)
+
+
+def test_matches_reference_parser_on_random_corpus(tmp_path: Path) -> None:
+    path = tmp_path / "panel.txt"
+    for text in random_cases(2000):
+        path.write_bytes(text.encode("utf-8"))
+        expected = reference_parse_panel(path)
+        actual = parse_panel(path)
+        assert actual == expected, f"parse_panel disagrees on {text!r}"
+
+
+def test_bom_inside_file_is_stripped_like_the_validator(tmp_path: Path) -> None:
+    path = tmp_path / "panel.txt"
+    path.write_text("# title: T\nAAA\n\ufeffBBB\n", encoding="utf-8")
+
+    _, genes = parse_panel(path)
+    validated_genes, errors, _ = load_panel(path)
+
+    assert genes == ["AAA", "BBB"]
+    assert not errors
+    assert validated_genes == genes